@@ -1,56 +1,166 @@
+import math
 import os
+import tarfile
+import uuid
+from typing import Any, List
+import faiss
+import numpy as np
 import pandas as pd
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import torch
+import zstandard
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_community.embeddings import HuggingFaceEmbeddings
 import boto3
+from boto3.s3.transfer import TransferConfig
 
 # Configuration
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "llmops-knowledge-base")  # default bucket name
 S3_FAISS_PREFIX = os.getenv("S3_FAISS_PREFIX", "faiss_index")
 LOCAL_FAISS_PATH = "faiss_index_local"
+# The whole index folder is shipped as one object to avoid per-object S3 overhead
+INDEX_ARCHIVE_NAME = "index.tar.zst"
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 128
+EMBED_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Fixed token windows give MiniLM uniformly sized inputs to batch
+CHUNK_TOKENS = 128
+CHUNK_OVERLAP_TOKENS = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+PQ_M = 48
+PQ_NBITS = 8
+# Below this size a PQ codebook (2**PQ_NBITS centroids per sub-quantizer) cannot be
+# trained reliably and the uncompressed HNSW graph is small anyway
+PQ_MIN_VECTORS = 10_000
+MB = 1024 * 1024
+# Split the index archive into 50 MiB parts uploaded over parallel connections
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=50 * MB,
+    max_concurrency=16,
+    use_threads=True,
+)
+
+
+def chunk_texts(texts: List[str], answers: List[str], tokenizer: Any) -> List[Document]:
+    """Split texts into CHUNK_TOKENS-token windows overlapping by CHUNK_OVERLAP_TOKENS.
+
+    Every chunk carries the full answer of its FAQ entry in metadata["answer"].
+    """
+    encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    stride = CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS
+    docs = []
+    for text, answer, offsets in zip(texts, answers, encoded["offset_mapping"]):
+        offsets = np.asarray(offsets)
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            continue
+        # Every window after the first adds at least one token not seen in the previous one
+        starts = np.arange(0, max(num_tokens - CHUNK_OVERLAP_TOKENS, 1), stride)
+        ends = np.minimum(starts + CHUNK_TOKENS, num_tokens)
+        # Map token spans back to the original text rather than decoding ids
+        for char_start, char_end in zip(offsets[starts, 0], offsets[ends - 1, 1]):
+            docs.append(Document(page_content=text[char_start:char_end], metadata={"answer": answer}))
+    return docs
+
+
+def pack_index(src_dir: str, archive_path: str) -> None:
+    """Write src_dir as a zstd-compressed tarball."""
+    with open(archive_path, "wb") as fh:
+        with zstandard.ZstdCompressor().stream_writer(fh) as compressor:
+            with tarfile.open(fileobj=compressor, mode="w|") as tar:
+                tar.add(src_dir, arcname=".")
+
+
+def build_index(embeddings: np.ndarray) -> faiss.Index:
+    """Build an HNSW index for small corpora and a compressed IVF-PQ index for large ones."""
+    # MiniLM is trained for cosine similarity: unit-length vectors + inner product
+    faiss.normalize_L2(embeddings)
+    num_vectors, dim = embeddings.shape
+    if num_vectors < PQ_MIN_VECTORS:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        nlist = int(math.sqrt(num_vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
 
 
 def main() -> None:
-    print("🔧 Initializing embedding model...")
-    embed_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    print(f"🔧 Initializing embedding model on {EMBED_DEVICE}...")
+    embed_model = HuggingFaceEmbeddings(
+        model_name=EMBED_MODEL_NAME,
+        model_kwargs={"device": EMBED_DEVICE},
+    )
 
     print("📚 Loading data...")
-    df = pd.read_csv("data/it_support_faq.csv")
-    
-    # Drop any rows with null values to prevent processing errors
-    df = df.dropna()
-    
-    # Convert all columns to string to handle any unexpected data types
-    df["question"] = df["question"].astype(str)
-    df["answer"] = df["answer"].astype(str)
+    # Parse with the multithreaded pyarrow reader straight into Arrow-backed string columns
+    df = pd.read_csv(
+        "data/it_support_faq.csv",
+        engine="pyarrow",
+        dtype_backend="pyarrow",
+        usecols=["question", "answer"],
+        dtype={"question": "string[pyarrow]", "answer": "string[pyarrow]"},
+    )
     
-    # Create texts by combining question and answer
-    texts = (df["question"] + " \nAnswer: " + df["answer"]).tolist()
+    # Drop rows with null values to prevent processing errors
+    df = df.dropna(subset=["question", "answer"])
     
-    # Filter out any empty or whitespace-only texts
-    texts = [text.strip() for text in texts if text.strip()]
+    # Strip whole columns at once and skip rows whose question or answer is blank
+    question = df["question"].str.strip()
+    answer = df["answer"].str.strip()
+    df["text"] = question + " \nAnswer: " + answer
+    valid = (question.str.len() > 0) & (answer.str.len() > 0)
+    texts = df.loc[valid, "text"].tolist()
+    answers = answer[valid].tolist()
     
     if not texts:
         raise ValueError("No valid text data found after processing CSV file")
     
     print(f"📄 Processing {len(texts)} text entries...")
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    docs = text_splitter.create_documents(texts)
+    docs = chunk_texts(texts, answers, embed_model.client.tokenizer)
+
+    print(f"🧮 Encoding {len(docs)} chunks (batch size {EMBED_BATCH_SIZE})...")
+    # Encode with the underlying SentenceTransformer directly so the whole corpus
+    # goes through large batches (it already length-sorts inputs to minimise padding)
+    contents = [doc.page_content for doc in docs]
+    embeddings = embed_model.client.encode(
+        contents,
+        batch_size=EMBED_BATCH_SIZE,
+        show_progress_bar=True,
+        convert_to_numpy=True,
+    )
 
     print("🔄 Creating FAISS vector index...")
-    vectorstore = FAISS.from_documents(docs, embed_model)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = build_index(embeddings)
+
+    ids = [str(uuid.uuid4()) for _ in docs]
+    vectorstore = FAISS(
+        embedding_function=embed_model,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, docs))),
+        index_to_docstore_id=dict(enumerate(ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
     os.makedirs(LOCAL_FAISS_PATH, exist_ok=True)
     vectorstore.save_local(LOCAL_FAISS_PATH)
 
+    archive_path = f"{LOCAL_FAISS_PATH}.tar.zst"
+    pack_index(LOCAL_FAISS_PATH, archive_path)
+
     print(f"☁️ Uploading index to S3 bucket '{S3_BUCKET_NAME}' under prefix '{S3_FAISS_PREFIX}'...")
     s3_client = boto3.client("s3")
-    for file_name in os.listdir(LOCAL_FAISS_PATH):
-        local_path = os.path.join(LOCAL_FAISS_PATH, file_name)
-        s3_key = f"{S3_FAISS_PREFIX}/{file_name}"
-        s3_client.upload_file(local_path, S3_BUCKET_NAME, s3_key)
-        print(f"Uploaded {local_path} -> s3://{S3_BUCKET_NAME}/{s3_key}")
+    s3_key = f"{S3_FAISS_PREFIX}/{INDEX_ARCHIVE_NAME}"
+    s3_client.upload_file(archive_path, S3_BUCKET_NAME, s3_key, Config=S3_TRANSFER_CONFIG)
+    print(f"Uploaded {archive_path} -> s3://{S3_BUCKET_NAME}/{s3_key}")
 
     print("✅ Data pipeline complete!")
 
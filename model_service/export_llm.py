@@ -0,0 +1,30 @@
+import os
+import tempfile
+from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+# Configuration
+LLM_MODEL_NAME = "distilgpt2"
+LLM_ONNX_DIR = os.getenv("LLM_ONNX_DIR", "distilgpt2_onnx_int8")
+ONNX_FILE_NAME = "model.onnx"
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as export_dir:
+        print(f"📦 Exporting {LLM_MODEL_NAME} to ONNX (with KV cache)...")
+        model = ORTModelForCausalLM.from_pretrained(LLM_MODEL_NAME, export=True, use_cache=True)
+        model.save_pretrained(export_dir)
+
+        print("🗜️ Applying dynamic int8 quantization (VNNI)...")
+        quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=ONNX_FILE_NAME)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=LLM_ONNX_DIR, quantization_config=qconfig)
+
+    model.config.save_pretrained(LLM_ONNX_DIR)
+    AutoTokenizer.from_pretrained(LLM_MODEL_NAME).save_pretrained(LLM_ONNX_DIR)
+    print(f"✅ Quantized model written to {LLM_ONNX_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,113 +1,464 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import math
 import os
+import pickle
 import uuid
+import tarfile
 import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def container_cpu_count() -> int:
+    """CPUs this process may use: the cgroup CPU quota (k8s limits) if set, else the visible cores."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            quota, period = fh.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: a quota of -1 means unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as fh:
+                quota = int(fh.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as fh:
+                period = int(fh.read())
+            if quota > 0:
+                cpus = min(cpus, math.ceil(quota / period))
+        except (OSError, ValueError):
+            pass
+    return max(1, cpus)
+
+
+CONTAINER_CPUS = container_cpu_count()
+# Enough workers to overlap generation with I/O without exceeding the pod's CPU limit
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, CONTAINER_CPUS))))
+
+# Pin OpenMP/BLAS pools before torch/faiss/transformers are imported. Every inference worker
+# runs its own parallel region, so workers x intra-op threads must stay within the CPU quota.
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", str(max(1, CONTAINER_CPUS // INFERENCE_WORKERS))))
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, str(INTRA_OP_THREADS))
+
 import boto3
+import faiss
+import numpy as np
+import onnxruntime as ort
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+import torch
+import zstandard
+from boto3.dynamodb.types import TypeSerializer
+from boto3.s3.transfer import TransferConfig
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from langchain.chains import RetrievalQA
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain.llms.base import LLM
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_client import Counter
-from transformers import AutoTokenizer, pipeline
-from typing import Optional, List, Any
+from sentence_transformers import SentenceTransformer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from optimum.onnxruntime import ORTModelForCausalLM
+from typing import Optional, List, Any, Callable, Set, Tuple
+
+try:
+    import intel_extension_for_pytorch as ipex
+except ImportError:  # optional, only used when EMBED_BF16=1
+    ipex = None
+
+
+logger = logging.getLogger(__name__)
 
 
 # Environment configuration
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
 S3_FAISS_PREFIX = os.getenv("S3_FAISS_PREFIX", "faiss_index")
+INDEX_ARCHIVE_NAME = "index.tar.zst"
 DYNAMODB_TABLE = os.getenv("DYNAMODB_FEEDBACK_TABLE")
+EMBED_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Opt-in BF16 query embeddings on CPU. Only faster on CPUs with AVX512-BF16/AMX (4th-gen Xeon+);
+# elsewhere bf16 is emulated and slower than fp32. Requires intel-extension-for-pytorch
+# matching the installed torch version, which is not part of requirements.txt.
+EMBED_BF16 = os.getenv("EMBED_BF16") == "1"
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "8"))
+LLM_MODEL_NAME = "distilgpt2"
+# The Docker image bakes the weights in and sets TRANSFORMERS_OFFLINE=1
+HF_OFFLINE = os.getenv("TRANSFORMERS_OFFLINE") == "1"
+# Written at image build time by export_llm.py
+LLM_ONNX_DIR = os.getenv("LLM_ONNX_DIR", "distilgpt2_onnx_int8")
+LLM_ONNX_FILE_NAME = "model_quantized.onnx"
+# Per-request generation budget; independent of prompt length and of the batch it lands in
+LLM_MAX_NEW_TOKENS = int(os.getenv("LLM_MAX_NEW_TOKENS", "64"))
+# Cosine similarity above which the top FAQ answer is returned verbatim instead of generating one
+LLM_SKIP_SIMILARITY = float(os.getenv("LLM_SKIP_SIMILARITY", "0.75"))
+CHAT_MAX_BATCH_SIZE = int(os.getenv("CHAT_MAX_BATCH_SIZE", "16"))
+CHAT_BATCH_WAIT_MS = float(os.getenv("CHAT_BATCH_WAIT_MS", "10"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "4096"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL")
+# A slow or unreachable Redis must degrade to a cache miss, not stall /chat
+REDIS_TIMEOUT_MS = float(os.getenv("REDIS_TIMEOUT_MS", "100"))
+S3_TRANSFER_CONFIG = TransferConfig(max_concurrency=8, multipart_chunksize=16 * 1024 * 1024)
 
 
 # Simple local LLM that doesn't need HuggingFace Hub authentication
 class LocalLLM:
     def __init__(self):
-        # Use a small, fast model that doesn't need authentication
-        self.text_generator = pipeline("text-generation", model="distilgpt2", device=-1)
+        # Use a small, fast model that doesn't need authentication. Prefer the int8
+        # ONNX Runtime export baked into the image; fall back to PyTorch for local runs.
+        if os.path.exists(os.path.join(LLM_ONNX_DIR, LLM_ONNX_FILE_NAME)):
+            # ONNX Runtime ignores OMP_NUM_THREADS and sizes its own pool to all cores
+            session_options = ort.SessionOptions()
+            session_options.intra_op_num_threads = INTRA_OP_THREADS
+            session_options.inter_op_num_threads = 1
+            self.model = ORTModelForCausalLM.from_pretrained(
+                LLM_ONNX_DIR, file_name=LLM_ONNX_FILE_NAME, use_cache=True, session_options=session_options
+            )
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(LLM_MODEL_NAME, local_files_only=HF_OFFLINE).eval()
+        # Prompts are tokenized once here and fed to generate() directly. GPT-2 has no pad
+        # token; pad on the left so batched prompts end where generation starts.
+        self.tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME, use_fast=True, local_files_only=HF_OFFLINE)
+        self.tokenizer.pad_token_id = 50256
+        self.tokenizer.padding_side = "left"
+        # Keep prompts within GPT-2's positions; cut from the left so the question at the end survives
+        self.tokenizer.truncation_side = "left"
+        self.max_prompt_tokens = self.model.config.n_positions - LLM_MAX_NEW_TOKENS
     
-    def __call__(self, prompt: str) -> str:
-        # Generate response using local model
+    def __call__(self, prompt: str) -> Optional[str]:
+        return self.generate([prompt])[0]
+
+    def generate(self, prompts: List[str]) -> List[Optional[str]]:
+        # Generate responses for a batch of prompts in one pass through the local model;
+        # None marks a failed generation so callers can fall back without caching it
         try:
-            response = self.text_generator(prompt, max_length=150, num_return_sequences=1, 
-                                         pad_token_id=50256, do_sample=True, temperature=0.7)
-            generated_text = response[0]['generated_text']
-            
-            # Clean up the response (remove the original prompt)
-            if generated_text.startswith(prompt):
-                generated_text = generated_text[len(prompt):].strip()
-            
-            # Return a meaningful response or default
-            return generated_text[:200] if generated_text else "I understand your question. Let me help you with that."
-        except Exception as e:
-            return f"I can help you with your question. Please provide more details."
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True,
+                                    truncation=True, max_length=self.max_prompt_tokens)
+            with torch.no_grad():
+                output_ids = self.model.generate(**inputs, max_new_tokens=LLM_MAX_NEW_TOKENS, num_return_sequences=1,
+                                                 pad_token_id=50256, do_sample=True, temperature=0.7)
+        except Exception:
+            logger.exception("LLM generation failed for a batch of %d prompts", len(prompts))
+            return [None] * len(prompts)
+
+        # Only the new tokens are decoded, so the prompt never has to be stripped from the text
+        completion_ids = output_ids[:, inputs["input_ids"].shape[1]:]
+        COMPLETION_TOKENS_COUNTER.inc(int((completion_ids != 50256).sum()))
+        generated_texts = self.tokenizer.batch_decode(completion_ids, skip_special_tokens=True)
+
+        # Return a meaningful response or default
+        return [
+            text.strip()[:200] if text.strip() else "I understand your question. Let me help you with that."
+            for text in generated_texts
+        ]
+
+
+# Collects concurrent requests for a few milliseconds and runs them as one batch
+class RequestBatcher:
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float,
+                 executor: ThreadPoolExecutor, max_in_flight: int):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.queue: "asyncio.Queue[Tuple[Any, asyncio.Future]]" = asyncio.Queue()
+        # At most one in-flight batch per executor worker; extra requests queue into the next batch
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._process(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            # Model calls block, keep them off the event loop
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.process_batch, items)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            self.slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# Two-level answer cache: in-process LRU, optionally backed by Redis shared across pods
+class AnswerCache:
+    def __init__(self, max_size: int, ttl: int, redis_url: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (monotonic expiry time, answer); entries expire with the same TTL as in Redis
+        self.local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.redis = redis.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_timeout=REDIS_TIMEOUT_MS / 1000,
+            socket_connect_timeout=REDIS_TIMEOUT_MS / 1000,
+        ) if redis_url else None
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def redis_key(key: str) -> str:
+        return "chatbot:answer:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, answer: str, ttl: float) -> None:
+        self.local[key] = (time.monotonic() + ttl, answer)
+        self.local.move_to_end(key)
+        if len(self.local) > self.max_size:
+            self.local.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self.local.get(key)
+        if entry is not None:
+            expires_at, answer = entry
+            if expires_at > time.monotonic():
+                self.local.move_to_end(key)
+                CACHE_HITS_COUNTER.labels(layer="local").inc()
+                return answer
+            del self.local[key]
+        if self.redis is not None:
+            redis_key = self.redis_key(key)
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    answer, ttl = await pipe.get(redis_key).ttl(redis_key).execute()
+            except RedisError:
+                answer = None
+            if answer is not None:
+                # Don't let the local copy outlive the shared one
+                self._remember(key, answer, ttl if ttl > 0 else self.ttl)
+                CACHE_HITS_COUNTER.labels(layer="redis").inc()
+                return answer
+        CACHE_MISSES_COUNTER.inc()
+        return None
+
+    async def set(self, key: str, answer: str) -> None:
+        self._remember(key, answer, self.ttl)
+        if self.redis is not None:
+            try:
+                await self.redis.setex(self.redis_key(key), self.ttl, answer)
+            except RedisError:
+                pass
+
+
+# A single SentenceTransformer shared by the vector store and the batch path, called directly
+# rather than through LangChain's HuggingFaceEmbeddings wrapper
+class SentenceEncoder(Embeddings):
+    def __init__(self, model_name: str, device: str, bf16: bool = False):
+        self.model = SentenceTransformer(model_name, device=device)
+        self.bf16 = bf16
+        if bf16:
+            if ipex is None:
+                raise RuntimeError("EMBED_BF16=1 requires intel-extension-for-pytorch to be installed")
+            # BF16 on Xeon CPUs (AMX / AVX512-BF16) via Intel Extension for PyTorch
+            self.model = ipex.optimize(self.model.eval(), dtype=torch.bfloat16)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not self.bf16:
+            return self.model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        with torch.no_grad(), torch.cpu.amp.autocast(dtype=torch.bfloat16):
+            embeddings = self.model.encode(texts, batch_size=64, convert_to_tensor=True, normalize_embeddings=True)
+        # numpy has no bfloat16, so cast back before handing vectors to FAISS
+        return embeddings.float().cpu().numpy()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
 
 
 app = FastAPI(title="LLMOps Chatbot")
-qa_chain = None
+qa_batcher = None
 tokenizer = None
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+# AWS handles are created once; building boto3 clients/resources per request is slow
+s3_client = boto3.client("s3")
+# Low-level clients are thread-safe, unlike resources; /feedback runs in the threadpool
+dynamodb_client = boto3.client("dynamodb")
+dynamodb_serializer = TypeSerializer()
+faiss_gpu_resources = None
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, REDIS_URL)
 
 
 # Prometheus Metrics
 PROMPT_TOKENS_COUNTER = Counter("chatbot_prompt_tokens_total", "Total prompt tokens")
 COMPLETION_TOKENS_COUNTER = Counter("chatbot_completion_tokens_total", "Total completion tokens")
+LLM_SKIPPED_COUNTER = Counter("chatbot_llm_skipped_total", "Queries answered from the FAQ without running the LLM")
+CACHE_HITS_COUNTER = Counter("chatbot_cache_hits_total", "Answers served from cache", ["layer"])
+CACHE_MISSES_COUNTER = Counter("chatbot_cache_misses_total", "Queries not found in the answer cache")
 
 
 def download_faiss_from_s3(local_dir: str) -> None:
-    """Download FAISS index folder from S3 into local_dir."""
-    s3 = boto3.client("s3")
-    paginator = s3.get_paginator("list_objects_v2")
-    prefix = f"{S3_FAISS_PREFIX}/"
-    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-            if key.endswith("/"):
-                continue
-            rel = key[len(prefix) :]
-            dest_path = os.path.join(local_dir, rel)
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            s3.download_file(S3_BUCKET, key, dest_path)
+    """Download the FAISS index archive from S3 and unpack it into local_dir."""
+    archive_path = os.path.join(local_dir, INDEX_ARCHIVE_NAME)
+    # A single object, fetched as parallel ranged GETs
+    s3_client.download_file(S3_BUCKET, f"{S3_FAISS_PREFIX}/{INDEX_ARCHIVE_NAME}", archive_path, Config=S3_TRANSFER_CONFIG)
+    with open(archive_path, "rb") as fh:
+        with zstandard.ZstdDecompressor().stream_reader(fh) as decompressor:
+            with tarfile.open(fileobj=decompressor, mode="r|") as tar:
+                tar.extractall(local_dir)
+    os.remove(archive_path)
+
+
+def load_vectorstore(local_dir: str, embeddings: Embeddings) -> FAISS:
+    """Load the FAISS store from local_dir, memory-mapping the index instead of copying it into RAM."""
+    # Same files as FAISS.load_local, but read_index is given mmap flags so IVF posting
+    # lists are paged in on demand from the extracted archive
+    index = faiss.read_index(os.path.join(local_dir, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    # The pickle is written by our own data pipeline
+    with open(os.path.join(local_dir, "index.pkl"), "rb") as fh:
+        docstore, index_to_docstore_id = pickle.load(fh)
+    # The index stores normalized MiniLM vectors under inner product (cosine similarity)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+
+
+def tune_faiss_index(index: faiss.Index) -> None:
+    """Apply query-time search parameters for the index type built by the data pipeline."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = FAISS_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = FAISS_NPROBE
+
+
+def index_to_gpu(index: faiss.Index) -> Optional[faiss.Index]:
+    """Copy the index to GPU 0 when a CUDA-enabled FAISS build and a GPU are available."""
+    global faiss_gpu_resources
+    if EMBED_DEVICE != "cuda" or not hasattr(faiss, "StandardGpuResources"):
+        return None
+    # FAISS has no GPU implementation of HNSW
+    if isinstance(index, faiss.IndexHNSW):
+        return None
+    faiss_gpu_resources = faiss.StandardGpuResources()
+    return faiss.index_cpu_to_gpu(faiss_gpu_resources, 0, index)
 
 
 @app.on_event("startup")
-def startup_event() -> None:
-    global qa_chain, tokenizer
+async def startup_event() -> None:
+    global qa_batcher, tokenizer
 
     if not S3_BUCKET:
         raise RuntimeError("S3_BUCKET_NAME env var is required")
 
+    faiss.omp_set_num_threads(INTRA_OP_THREADS)
+    torch.set_num_threads(INTRA_OP_THREADS)
+
     # Initialize tokenizer with simple model (no authentication needed)
-    tokenizer = AutoTokenizer.from_pretrained("distilgpt2")
+    tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME, use_fast=True, local_files_only=HF_OFFLINE)
 
     # Initialize components
-    embed_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    embed_model = SentenceEncoder(
+        "sentence-transformers/all-MiniLM-L6-v2",
+        device=EMBED_DEVICE,
+        bf16=EMBED_DEVICE == "cpu" and EMBED_BF16,
+    )
 
     # Download and load vector store from S3
     local_index_dir = os.path.join(tempfile.gettempdir(), "faiss_index")
     os.makedirs(local_index_dir, exist_ok=True)
     download_faiss_from_s3(local_index_dir)
-    vectorstore = FAISS.load_local(local_index_dir, embed_model, allow_dangerous_deserialization=True)
+    vectorstore = load_vectorstore(local_index_dir, embed_model)
+    tune_faiss_index(vectorstore.index)
+    gpu_index = index_to_gpu(vectorstore.index)
+    if gpu_index is not None:
+        vectorstore.index = gpu_index
+    # StandardGpuResources must not be used from several inference threads at once
+    index_lock = threading.Lock() if gpu_index is not None else contextlib.nullcontext()
 
     # Initialize local LLM (no HuggingFace Hub needed)
     local_llm = LocalLLM()
     
-    # Simple QA function that combines retrieval with local generation
-    def simple_qa(question: str) -> str:
-        # Get relevant documents from vector store
-        docs = vectorstore.similarity_search(question, k=3)
-        
-        # Combine context from retrieved documents
-        context = "\n".join([doc.page_content for doc in docs])
-        
-        # Create a prompt with context
-        prompt = f"Context: {context}\n\nQuestion: {question}\n\nAnswer:"
+    # Simple QA function that combines retrieval with local generation for a batch of questions
+    def simple_qa(questions: List[str]) -> List[Optional[str]]:
+        # Embed all questions in one forward pass
+        query_vectors = embed_model.encode(questions)
+
+        # Search the whole batch in one FAISS call (a single GEMM on the GPU)
+        with index_lock:
+            scores, indices = vectorstore.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), 2)
+
+        answers: List[Optional[str]] = [None] * len(questions)
+        prompts, prompt_slots = [], []
+        for slot, (question, row_scores, row) in enumerate(zip(questions, scores, indices)):
+            # Get relevant documents from the docstore
+            docs = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in row if i != -1]
+
+            # A close enough FAQ match already is the answer; skip generation entirely. Chunks
+            # may be partial windows of an entry, so return the full answer stored with them.
+            if row[0] != -1 and row_scores[0] >= LLM_SKIP_SIMILARITY and "answer" in docs[0].metadata:
+                answers[slot] = docs[0].metadata["answer"]
+                LLM_SKIPPED_COUNTER.inc()
+                continue
+            
+            # Combine context from retrieved documents
+            context = "\n".join([doc.page_content for doc in docs])
+            
+            # Create a prompt with context
+            prompts.append(f"Context: {context}\n\nQuestion: {question}\n\nAnswer:")
+            prompt_slots.append(slot)
         
-        # Generate response using local model
-        response = local_llm(prompt)
-        return response if response else "I can help you with IT support questions based on our knowledge base."
+        # Generate responses for the remaining questions using local model
+        if prompts:
+            for slot, response in zip(prompt_slots, local_llm.generate(prompts)):
+                answers[slot] = response
+        return answers
     
-    # Store the QA function globally
-    qa_chain = simple_qa
+    # Serve the QA function through the dynamic batcher
+    qa_batcher = RequestBatcher(simple_qa, CHAT_MAX_BATCH_SIZE, CHAT_BATCH_WAIT_MS,
+                                inference_pool, INFERENCE_WORKERS)
+    app.state.batcher_task = asyncio.create_task(qa_batcher.run())
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    batcher_task = getattr(app.state, "batcher_task", None)
+    if batcher_task is not None:
+        batcher_task.cancel()
+    inference_pool.shutdown(wait=False, cancel_futures=True)
 
 
 # Enable Prometheus metrics
@@ -137,19 +488,25 @@ def health():
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    if not qa_chain or not tokenizer:
+async def chat(req: ChatRequest):
+    if not qa_batcher or not tokenizer:
         raise HTTPException(status_code=503, detail="Service initializing")
 
     # Token counting
     prompt_tokens = len(tokenizer.encode(req.query))
     PROMPT_TOKENS_COUNTER.inc(prompt_tokens)
 
-    # Call the QA function directly
-    result = qa_chain(req.query)
-
-    completion_tokens = len(tokenizer.encode(result))
-    COMPLETION_TOKENS_COUNTER.inc(completion_tokens)
+    # Repeated questions skip retrieval and generation entirely
+    cache_key = AnswerCache.normalize(req.query)
+    result = await answer_cache.get(cache_key)
+    if result is None:
+        # Queue the query; concurrent requests are answered together
+        result = await qa_batcher.submit(req.query)
+        if result is None:
+            # Generation failed; reply with a fallback but never cache it
+            result = "I can help you with your question. Please provide more details."
+        else:
+            await answer_cache.set(cache_key, result)
 
     return {"answer": result, "query_id": str(uuid.uuid4())}
 
@@ -158,8 +515,8 @@ def chat(req: ChatRequest):
 def feedback(req: FeedbackRequest):
     if not DYNAMODB_TABLE:
         raise HTTPException(status_code=500, detail="DynamoDB table not configured")
-    table = boto3.resource("dynamodb").Table(DYNAMODB_TABLE)
-    table.put_item(Item=req.dict())
+    item = {key: dynamodb_serializer.serialize(value) for key, value in req.dict().items()}
+    dynamodb_client.put_item(TableName=DYNAMODB_TABLE, Item=item)
     return {"status": "Feedback recorded"}
 
 